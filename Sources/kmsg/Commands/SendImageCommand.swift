@@ -27,18 +27,24 @@ struct SendImageCommand: ParsableCommand {
     var deepRecovery: Bool = false
 
     func run() throws {
+        // Validate the image before asking for permission or touching KakaoTalk.
+        let imageURL = URL(fileURLWithPath: imagePath)
+        let resolvedPath = imageURL.resolvingSymlinksInPath().path
+        guard let attributes = try? FileManager.default.attributesOfItem(atPath: resolvedPath) else {
+            print("Error: File not found at \(imagePath)")
+            throw ExitCode.failure
+        }
+        guard (attributes[.type] as? FileAttributeType) == FileAttributeType.typeRegular else {
+            print("Error: File not found at \(imagePath) (not a regular file)")
+            throw ExitCode.failure
+        }
+
         guard AccessibilityPermission.ensureGranted() else {
             AccessibilityPermission.printInstructions()
             throw ExitCode.failure
         }
 
         let runner = AXActionRunner(traceEnabled: traceAX)
-        let imageURL = URL(fileURLWithPath: imagePath)
-
-        guard FileManager.default.fileExists(atPath: imagePath) else {
-            print("Error: File not found at \(imagePath)")
-            throw ExitCode.failure
-        }
 
         let kakao = try KakaoTalkApp()
         let chatWindowResolver = ChatWindowResolver(
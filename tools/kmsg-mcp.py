@@ -2,33 +2,170 @@
 """MCP stdio server that exposes kmsg read/send/send-image tools for OpenClaw.
 
 This server intentionally uses only Python's standard library so it can run
-without extra package installation.
+without extra package installation. If ``orjson`` happens to be installed it is
+used to encode and decode JSON faster; otherwise the stdlib ``json`` module is
+used.
 """
 
 from __future__ import annotations
 
+import functools
 import json
 import os
+import queue
+import re
 import shutil
 import subprocess
 import sys
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# One shared encoder instead of json.dumps(..., ensure_ascii=False), which
+# builds a new JSONEncoder on every call. json.loads already reuses a module
+# level decoder when called without options.
+_ENCODER = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+# orjson is only a fast path. It rejects NaN and lone surrogates and cannot
+# represent integers beyond 64 bits, all of which are valid in client
+# requests, so JSON-RPC bodies are always parsed with json.loads and any
+# payload orjson refuses to encode falls back to the stdlib encoder.
+try:
+    import orjson
+
+    _loads = orjson.loads
+
+    def _dumps(obj: Any) -> bytes:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            return _ENCODER.encode(obj).encode("utf-8")
+
+except ImportError:
+    _loads = json.loads
+
+    def _dumps(obj: Any) -> bytes:
+        return _ENCODER.encode(obj).encode("utf-8")
 
 JSONDict = Dict[str, Any]
 
+_MAX_STDERR_BYTES = 64 * 1024
+_FRAME_HEADER = b"Content-Length: %d\r\n\r\n"
+_CONTENT_LENGTH_RE = re.compile(rb"(?im)^[ \t]*content-length[ \t]*:[ \t]*(\d+)")
+
+# kmsg failure markers, matched in one pass over the raw output. Only the
+# "not found" family is case-insensitive; the others are emitted verbatim.
+_ERROR_MARKER_RE = re.compile(
+    rb"(?i:no such file or directory|not found)|WINDOW_NOT_READY|SEARCH_MISS|Accessibility|"
+    + re.escape("손쉬운 사용".encode("utf-8"))
+)
+_ERROR_MARKER_CODES = {
+    b"no such file or directory": "KMSG_BIN_NOT_FOUND",
+    b"not found": "KMSG_BIN_NOT_FOUND",
+    b"window_not_ready": "KAKAO_WINDOW_UNAVAILABLE",
+    b"search_miss": "CHAT_NOT_FOUND",
+    b"accessibility": "ACCESSIBILITY_PERMISSION_DENIED",
+    "손쉬운 사용".encode("utf-8"): "ACCESSIBILITY_PERMISSION_DENIED",
+}
+# When several markers appear, the first code in this order wins.
+_ERROR_CODE_PRIORITY = (
+    "KMSG_BIN_NOT_FOUND",
+    "KAKAO_WINDOW_UNAVAILABLE",
+    "CHAT_NOT_FOUND",
+    "ACCESSIBILITY_PERMISSION_DENIED",
+)
+
+_ERROR_HINTS = {
+    "KMSG_BIN_NOT_FOUND": "Set a valid KMSG_BIN path or install kmsg into PATH.",
+    "KAKAO_WINDOW_UNAVAILABLE": "KakaoTalk window was not ready. Open KakaoTalk and retry (or enable deep_recovery).",
+    "CHAT_NOT_FOUND": "Chat was not found in search results. Verify chat name spacing and visibility.",
+    "ACCESSIBILITY_PERMISSION_DENIED": "Grant Accessibility permission in System Settings > Privacy & Security > Accessibility.",
+}
+_DEFAULT_ERROR_HINT = "Check raw_stdout/raw_stderr and rerun with trace_ax=true for details."
+
+# kmsg send-image rejecting its image argument; only checked for tools with an
+# image_arg, since "not found" elsewhere means KMSG_BIN_NOT_FOUND.
+_IMAGE_NOT_FOUND_RE = re.compile(rb"(?i)file not found at")
+_IMAGE_PATH_HINT = "Provide a valid local image file path."
+
+
+def _map_hint(code: str) -> str:
+    return _ERROR_HINTS.get(code, _DEFAULT_ERROR_HINT)
+
+
+def _decode_output(data: bytes) -> str:
+    return data.decode("utf-8", errors="replace")
+
+
+def _bound_stderr(stderr: bytes) -> bytes:
+    # --trace-ax runs (especially with deep recovery) can write megabytes to
+    # stderr. Responses keep only the tail, which holds the latest trace steps;
+    # error classification still sees the full output.
+    if len(stderr) <= _MAX_STDERR_BYTES:
+        return stderr
+    dropped = len(stderr) - _MAX_STDERR_BYTES
+    return b"[... %d bytes of stderr truncated ...]\n" % dropped + stderr[-_MAX_STDERR_BYTES:]
+
 
 @dataclass
 class CommandResult:
     returncode: int
-    stdout: str
-    stderr: str
+    stdout: bytes
+    stderr: bytes
     latency_ms: int
     timed_out: bool = False
 
 
+@dataclass(frozen=True)
+class ToolSpec:
+    subcommand: str
+    # Required string arguments, passed to kmsg positionally in this order.
+    required: Tuple[str, ...]
+    timeout_sec: float
+    deep_recovery_timeout_sec: float
+    timeout_hint: str
+    # Tool passes --json --limit and returns the parsed message payload.
+    json_output: bool = False
+    # On CHAT_NOT_FOUND without deep recovery, retry once with it enabled.
+    retry_deep_recovery: bool = False
+    # Tool honours confirm=true by refusing to run.
+    confirmable: bool = False
+    # Argument that must name an existing local image file.
+    image_arg: Optional[str] = None
+
+
+TOOL_SPECS: Dict[str, ToolSpec] = {
+    "kmsg_read": ToolSpec(
+        subcommand="read",
+        required=("chat",),
+        timeout_sec=8.0,
+        deep_recovery_timeout_sec=15.0,
+        timeout_hint="Increase stability (keep KakaoTalk open/focused) and retry.",
+        json_output=True,
+        retry_deep_recovery=True,
+    ),
+    "kmsg_send": ToolSpec(
+        subcommand="send",
+        required=("chat", "message"),
+        timeout_sec=10.0,
+        deep_recovery_timeout_sec=18.0,
+        timeout_hint="Retry after ensuring KakaoTalk is responsive.",
+        confirmable=True,
+    ),
+    "kmsg_send_image": ToolSpec(
+        subcommand="send-image",
+        required=("chat", "image_path"),
+        timeout_sec=12.0,
+        deep_recovery_timeout_sec=20.0,
+        timeout_hint="Retry after ensuring KakaoTalk is responsive.",
+        confirmable=True,
+        image_arg="image_path",
+    ),
+}
+
+
 class MCPError(Exception):
     def __init__(self, code: int, message: str, data: Optional[JSONDict] = None) -> None:
         super().__init__(message)
@@ -37,46 +174,62 @@ class MCPError(Exception):
         self.data = data or {}
 
 
-class KmsgRunner:
-    def __init__(self) -> None:
-        self.kmsg_bin = self._resolve_kmsg_bin()
+@functools.lru_cache(maxsize=1)
+def _resolve_kmsg_bin() -> str:
+    env_bin = os.environ.get("KMSG_BIN", "").strip()
+    if env_bin:
+        return env_bin
+
+    which_bin = shutil.which("kmsg")
+    if which_bin:
+        return which_bin
 
-    def _resolve_kmsg_bin(self) -> str:
-        env_bin = os.environ.get("KMSG_BIN", "").strip()
-        if env_bin:
-            return env_bin
+    fallback = os.path.expanduser("~/.local/bin/kmsg")
+    return fallback
 
-        which_bin = shutil.which("kmsg")
-        if which_bin:
-            return which_bin
 
-        fallback = os.path.expanduser("~/.local/bin/kmsg")
-        return fallback
+@functools.lru_cache(maxsize=1)
+def _resolve_server_version() -> str:
+    explicit = os.environ.get("KMSG_MCP_VERSION", "").strip()
+    if explicit:
+        return explicit
+
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    version_path = os.path.join(repo_root, "VERSION")
+    try:
+        with open(version_path, "r", encoding="utf-8") as fp:
+            candidate = fp.read().strip().split("\n", 1)[0].strip()
+    except OSError:
+        candidate = ""
+
+    return candidate or "0.0.0"
+
+
+class KmsgRunner:
+    def __init__(self) -> None:
+        self.kmsg_bin = _resolve_kmsg_bin()
 
     def run(self, args: List[str], timeout_sec: float) -> CommandResult:
-        start = time.time()
+        start = time.perf_counter_ns()
         try:
             proc = subprocess.Popen(
                 args,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
-                text=True,
-                encoding="utf-8",
-                errors="replace",
             )
         except OSError as exc:
-            latency_ms = int((time.time() - start) * 1000)
+            latency_ms = (time.perf_counter_ns() - start) // 1_000_000
             return CommandResult(
                 returncode=127,
-                stdout="",
-                stderr=str(exc),
+                stdout=b"",
+                stderr=str(exc).encode("utf-8"),
                 latency_ms=latency_ms,
                 timed_out=False,
             )
 
         try:
             stdout, stderr = proc.communicate(timeout=timeout_sec)
-            latency_ms = int((time.time() - start) * 1000)
+            latency_ms = (time.perf_counter_ns() - start) // 1_000_000
             return CommandResult(
                 returncode=proc.returncode,
                 stdout=stdout,
@@ -87,7 +240,7 @@ class KmsgRunner:
         except subprocess.TimeoutExpired:
             proc.kill()
             stdout, stderr = proc.communicate()
-            latency_ms = int((time.time() - start) * 1000)
+            latency_ms = (time.perf_counter_ns() - start) // 1_000_000
             return CommandResult(
                 returncode=124,
                 stdout=stdout,
@@ -102,8 +255,8 @@ class KmsgRunner:
             return False, {
                 "stage": "version",
                 "message": "kmsg binary not executable",
-                "stdout": version.stdout,
-                "stderr": version.stderr,
+                "stdout": _decode_output(version.stdout),
+                "stderr": _decode_output(version.stderr),
                 "kmsg_bin": self.kmsg_bin,
             }
 
@@ -112,14 +265,14 @@ class KmsgRunner:
             return False, {
                 "stage": "status",
                 "message": "kmsg status check failed",
-                "stdout": status.stdout,
-                "stderr": status.stderr,
+                "stdout": _decode_output(status.stdout),
+                "stderr": _decode_output(status.stderr),
                 "kmsg_bin": self.kmsg_bin,
             }
 
         return True, {
             "kmsg_bin": self.kmsg_bin,
-            "version": version.stdout.strip(),
+            "version": _decode_output(version.stdout).strip(),
         }
 
 
@@ -149,60 +302,73 @@ def _make_text_content(text: str) -> List[JSONDict]:
     return [{"type": "text", "text": text}]
 
 
+@functools.lru_cache(maxsize=128)
+def _limit_str(limit: int) -> str:
+    return str(limit)
+
+
+@functools.lru_cache(maxsize=8)
+def _option_flags(deep_recovery: bool, keep_window: bool, trace_ax: bool) -> Tuple[str, ...]:
+    flags: List[str] = []
+    if deep_recovery:
+        flags.append("--deep-recovery")
+    if keep_window:
+        flags.append("--keep-window")
+    if trace_ax:
+        flags.append("--trace-ax")
+    return tuple(flags)
+
+
 class OpenClawKmsgMCPServer:
     PROTOCOL_VERSION = "2024-11-05"
+    PRE_INIT_METHODS = frozenset({"initialize", "notifications/initialized", "ping"})
 
     def __init__(self) -> None:
         self.runner = KmsgRunner()
         self.shutdown = False
         self.initialized = False
-        self._write_lock = threading.Lock()
+        # Pre-framed responses for the writer thread; None tells it to stop.
+        self._out_queue: "queue.Queue[Optional[bytes]]" = queue.Queue(maxsize=64)
 
         deep_recovery_default = os.environ.get("KMSG_DEFAULT_DEEP_RECOVERY", "false").lower() == "true"
         trace_default = os.environ.get("KMSG_TRACE_DEFAULT", "false").lower() == "true"
+        # Clients that read structuredContent do not need the same result
+        # serialized again as text, which doubles the size of large reads.
+        self.structured_only = os.environ.get("KMSG_MCP_STRUCTURED_ONLY", "false").lower() == "true"
 
         self.defaults = {
             "deep_recovery": deep_recovery_default,
             "trace_ax": trace_default,
         }
-        self.server_version = self._resolve_server_version()
-
-    def _resolve_server_version(self) -> str:
-        explicit = os.environ.get("KMSG_MCP_VERSION", "").strip()
-        if explicit:
-            return explicit
-
-        repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        version_path = os.path.join(repo_root, "VERSION")
-        try:
-            with open(version_path, "r", encoding="utf-8") as fp:
-                for line in fp:
-                    candidate = line.strip()
-                    if candidate:
-                        return candidate
-        except OSError:
-            pass
+        self.server_version = _resolve_server_version()
+        self._tools = self._tool_definitions()
+        self._tool_prefixes = {
+            name: (self.runner.kmsg_bin, spec.subcommand) for name, spec in TOOL_SPECS.items()
+        }
 
-        return "0.0.0"
+        # Handlers return the JSON-RPC result, or None when no response is sent.
+        self._method_handlers: Dict[str, Callable[[JSONDict], Optional[JSONDict]]] = {
+            "initialize": self._handle_initialize,
+            "notifications/initialized": self._handle_initialized,
+            "ping": self._handle_ping,
+            "tools/list": self._handle_tools_list,
+            "tools/call": self._handle_tools_call,
+            "shutdown": self._handle_shutdown,
+            "exit": self._handle_exit,
+        }
 
     def _read_message(self) -> Optional[JSONDict]:
-        headers: Dict[str, str] = {}
+        header = bytearray()
         while True:
             line = sys.stdin.buffer.readline()
             if not line:
                 return None
             if line in (b"\r\n", b"\n"):
                 break
+            header += line
 
-            decoded = line.decode("utf-8", errors="replace").strip()
-            if not decoded:
-                continue
-            key, sep, value = decoded.partition(":")
-            if not sep:
-                continue
-            headers[key.strip().lower()] = value.strip()
-
-        content_length = int(headers.get("content-length", "0"))
+        match = _CONTENT_LENGTH_RE.search(header)
+        content_length = int(match.group(1)) if match else 0
         if content_length <= 0:
             return None
 
@@ -211,17 +377,40 @@ class OpenClawKmsgMCPServer:
             return None
 
         try:
-            return json.loads(body.decode("utf-8"))
-        except json.JSONDecodeError:
-            return None
+            return json.loads(body)
+        except ValueError:
+            # A malformed body is skipped, not treated as end of input.
+            return {}
 
     def _write_message(self, payload: JSONDict) -> None:
-        encoded = json.dumps(payload, ensure_ascii=False).encode("utf-8")
-        header = f"Content-Length: {len(encoded)}\r\n\r\n".encode("ascii")
-        with self._write_lock:
-            sys.stdout.buffer.write(header)
-            sys.stdout.buffer.write(encoded)
-            sys.stdout.buffer.flush()
+        encoded = _dumps(payload)
+        self._out_queue.put(_FRAME_HEADER % len(encoded) + encoded)
+
+    def _drain_output(self) -> None:
+        out = sys.stdout.buffer
+        broken = False
+        while True:
+            frame = self._out_queue.get()
+            if broken:
+                if frame is None:
+                    return
+                continue
+            try:
+                if frame is None:
+                    # Frames queued right before the sentinel skipped the
+                    # flush above because the queue was not yet empty.
+                    out.flush()
+                    return
+                out.write(frame)
+                if self._out_queue.empty():
+                    out.flush()
+            except Exception as err:  # noqa: BLE001
+                # The client went away (or stdout is otherwise unusable). Keep
+                # consuming so producers never block on a full queue, and let
+                # the reader loop wind down.
+                print(f"kmsg-mcp: stdout write failed, dropping responses: {err}", file=sys.stderr)
+                broken = True
+                self.shutdown = True
 
     def _tool_definitions(self) -> List[JSONDict]:
         return [
@@ -326,8 +515,8 @@ class OpenClawKmsgMCPServer:
         code: str,
         message: str,
         hint: str,
-        raw_stdout: str,
-        raw_stderr: str,
+        raw_stdout: bytes,
+        raw_stderr: bytes,
         latency_ms: int,
     ) -> JSONDict:
         return {
@@ -336,307 +525,185 @@ class OpenClawKmsgMCPServer:
                 "code": code,
                 "message": message,
                 "hint": hint,
-                "raw_stdout": raw_stdout,
-                "raw_stderr": raw_stderr,
+                "raw_stdout": _decode_output(raw_stdout),
+                "raw_stderr": _decode_output(_bound_stderr(raw_stderr)),
             },
             "meta": {
                 "latency_ms": latency_ms,
             },
         }
 
-    def _extract_error_code(self, combined_text: str) -> str:
-        lowered = combined_text.lower()
-        if "no such file or directory" in lowered or "not found" in lowered:
-            return "KMSG_BIN_NOT_FOUND"
-        if "WINDOW_NOT_READY" in combined_text:
-            return "KAKAO_WINDOW_UNAVAILABLE"
-        if "SEARCH_MISS" in combined_text:
-            return "CHAT_NOT_FOUND"
-        if "Accessibility" in combined_text or "손쉬운 사용" in combined_text:
-            return "ACCESSIBILITY_PERMISSION_DENIED"
+    def _extract_error_code(self, stdout: bytes, stderr: bytes) -> str:
+        found = {
+            _ERROR_MARKER_CODES[marker.lower()]
+            for output in (stdout, stderr)
+            if output
+            for marker in _ERROR_MARKER_RE.findall(output)
+        }
+        for code in _ERROR_CODE_PRIORITY:
+            if code in found:
+                return code
         return "UNKNOWN_EXEC_FAILURE"
 
-    def _map_hint(self, code: str) -> str:
-        if code == "KMSG_BIN_NOT_FOUND":
-            return "Set a valid KMSG_BIN path or install kmsg into PATH."
-        if code == "KAKAO_WINDOW_UNAVAILABLE":
-            return "KakaoTalk window was not ready. Open KakaoTalk and retry (or enable deep_recovery)."
-        if code == "CHAT_NOT_FOUND":
-            return "Chat was not found in search results. Verify chat name spacing and visibility."
-        if code == "ACCESSIBILITY_PERMISSION_DENIED":
-            return "Grant Accessibility permission in System Settings > Privacy & Security > Accessibility."
-        return "Check raw_stdout/raw_stderr and rerun with trace_ax=true for details."
-
-    def _call_kmsg_read(self, arguments: JSONDict) -> JSONDict:
-        chat = str(arguments.get("chat", "")).strip()
-        if not chat:
-            return self._error_payload(
-                code="INVALID_ARGUMENT",
-                message="chat is required",
-                hint="Provide a non-empty chat name.",
-                raw_stdout="",
-                raw_stderr="",
-                latency_ms=0,
-            )
-
-        raw_limit = arguments.get("limit", 20)
-        try:
-            limit = int(raw_limit)
-        except (TypeError, ValueError):
-            return self._error_payload(
-                code="INVALID_ARGUMENT",
-                message="limit must be an integer",
-                hint="Use integer range 1..100 for limit.",
-                raw_stdout="",
-                raw_stderr="",
-                latency_ms=0,
-            )
-        limit = max(1, min(limit, 100))
-
-        deep_recovery = bool(arguments.get("deep_recovery", self.defaults["deep_recovery"]))
-        keep_window = bool(arguments.get("keep_window", False))
-        trace_ax = bool(arguments.get("trace_ax", self.defaults["trace_ax"]))
-
-        cmd = [self.runner.kmsg_bin, "read", chat, "--json", "--limit", str(limit)]
-        if deep_recovery:
-            cmd.append("--deep-recovery")
-        if keep_window:
-            cmd.append("--keep-window")
-        if trace_ax:
-            cmd.append("--trace-ax")
-
-        timeout_sec = 15.0 if deep_recovery else 8.0
-        first = self.runner.run(cmd, timeout_sec=timeout_sec)
-
-        if first.timed_out:
-            return self._error_payload(
-                code="PROCESS_TIMEOUT",
-                message="kmsg read timed out",
-                hint="Increase stability (keep KakaoTalk open/focused) and retry.",
-                raw_stdout=first.stdout,
-                raw_stderr=first.stderr,
-                latency_ms=first.latency_ms,
-            )
-
-        if first.returncode != 0:
-            combined = f"{first.stdout}\n{first.stderr}"
-            code = self._extract_error_code(combined)
-
-            if code == "CHAT_NOT_FOUND" and not deep_recovery:
-                retry_cmd = cmd + ["--deep-recovery"]
-                retry = self.runner.run(retry_cmd, timeout_sec=15.0)
-                if retry.returncode == 0 and not retry.timed_out:
-                    first = retry
-                else:
-                    retry_combined = f"{retry.stdout}\n{retry.stderr}"
-                    retry_code = self._extract_error_code(retry_combined)
-                    return self._error_payload(
-                        code=retry_code,
-                        message="kmsg read failed after deep-recovery retry",
-                        hint=self._map_hint(retry_code),
-                        raw_stdout=retry.stdout,
-                        raw_stderr=retry.stderr,
-                        latency_ms=retry.latency_ms,
-                    )
+    def _call_tool(self, name: str, spec: ToolSpec, arguments: JSONDict) -> JSONDict:
+        values = [str(arguments.get(key, "")).strip() for key in spec.required]
+        if not all(values):
+            if len(spec.required) == 1:
+                message = f"{spec.required[0]} is required"
+                hint = f"Provide a non-empty {spec.required[0]}."
             else:
-                return self._error_payload(
-                    code=code,
-                    message="kmsg read failed",
-                    hint=self._map_hint(code),
-                    raw_stdout=first.stdout,
-                    raw_stderr=first.stderr,
-                    latency_ms=first.latency_ms,
-                )
-
-        try:
-            payload = json.loads(first.stdout)
-        except json.JSONDecodeError:
-            return self._error_payload(
-                code="INVALID_JSON_OUTPUT",
-                message="kmsg returned non-JSON output for read --json",
-                hint="Run kmsg read manually and confirm JSON-only stdout.",
-                raw_stdout=first.stdout,
-                raw_stderr=first.stderr,
-                latency_ms=first.latency_ms,
-            )
-
-        response: JSONDict = {
-            "ok": True,
-            "chat": payload.get("chat", chat),
-            "fetched_at": payload.get("fetched_at"),
-            "count": payload.get("count", 0),
-            "messages": payload.get("messages", []),
-            "meta": {
-                "latency_ms": first.latency_ms,
-            },
-        }
-
-        if trace_ax and first.stderr.strip():
-            response["meta"]["stderr_trace"] = first.stderr
-
-        return response
-
-    def _call_kmsg_send(self, arguments: JSONDict) -> JSONDict:
-        chat = str(arguments.get("chat", "")).strip()
-        message = str(arguments.get("message", "")).strip()
-        confirm = bool(arguments.get("confirm", False))
-
-        if not chat or not message:
+                message = f"{' and '.join(spec.required)} are required"
+                hint = f"Provide both {' and '.join(spec.required)}."
             return self._error_payload(
                 code="INVALID_ARGUMENT",
-                message="chat and message are required",
-                hint="Provide both chat and message.",
-                raw_stdout="",
-                raw_stderr="",
+                message=message,
+                hint=hint,
+                raw_stdout=b"",
+                raw_stderr=b"",
                 latency_ms=0,
             )
 
-        if confirm:
+        if spec.confirmable and bool(arguments.get("confirm", False)):
             return self._error_payload(
                 code="CONFIRMATION_REQUIRED",
-                message="kmsg_send blocked because confirm=true requests pre-send confirmation",
+                message=f"{name} blocked because confirm=true requests pre-send confirmation",
                 hint="Ask user for explicit approval, then call again with confirm=false (or omit confirm).",
-                raw_stdout="",
-                raw_stderr="",
+                raw_stdout=b"",
+                raw_stderr=b"",
                 latency_ms=0,
             )
 
-        deep_recovery = bool(arguments.get("deep_recovery", self.defaults["deep_recovery"]))
-        keep_window = bool(arguments.get("keep_window", False))
-        trace_ax = bool(arguments.get("trace_ax", self.defaults["trace_ax"]))
-
-        cmd = [self.runner.kmsg_bin, "send", chat, message]
-        if deep_recovery:
-            cmd.append("--deep-recovery")
-        if keep_window:
-            cmd.append("--keep-window")
-        if trace_ax:
-            cmd.append("--trace-ax")
-
-        timeout_sec = 18.0 if deep_recovery else 10.0
-        run = self.runner.run(cmd, timeout_sec=timeout_sec)
-
-        if run.timed_out:
-            return self._error_payload(
-                code="PROCESS_TIMEOUT",
-                message="kmsg send timed out",
-                hint="Retry after ensuring KakaoTalk is responsive.",
-                raw_stdout=run.stdout,
-                raw_stderr=run.stderr,
-                latency_ms=run.latency_ms,
-            )
-
-        if run.returncode != 0:
-            combined = f"{run.stdout}\n{run.stderr}"
-            code = self._extract_error_code(combined)
-            return self._error_payload(
-                code=code,
-                message="kmsg send failed",
-                hint=self._map_hint(code),
-                raw_stdout=run.stdout,
-                raw_stderr=run.stderr,
-                latency_ms=run.latency_ms,
-            )
-
-        response: JSONDict = {
-            "ok": True,
-            "chat": chat,
-            "sent": True,
-            "meta": {
-                "latency_ms": run.latency_ms,
-                "stdout": run.stdout,
-            },
-        }
-
-        if trace_ax and run.stderr.strip():
-            response["meta"]["stderr_trace"] = run.stderr
-
-        return response
-
-    def _call_kmsg_send_image(self, arguments: JSONDict) -> JSONDict:
-        chat = str(arguments.get("chat", "")).strip()
-        image_path = str(arguments.get("image_path", "")).strip()
-        confirm = bool(arguments.get("confirm", False))
-
-        if not chat or not image_path:
+        # Checked here rather than left to kmsg: older kmsg releases accept
+        # directories and only look at the path after the permission check.
+        if spec.image_arg and not os.path.isfile(str(arguments.get(spec.image_arg, "")).strip()):
             return self._error_payload(
                 code="INVALID_ARGUMENT",
-                message="chat and image_path are required",
-                hint="Provide both chat and image_path.",
-                raw_stdout="",
-                raw_stderr="",
-                latency_ms=0,
-            )
-
-        if confirm:
-            return self._error_payload(
-                code="CONFIRMATION_REQUIRED",
-                message="kmsg_send_image blocked because confirm=true requests pre-send confirmation",
-                hint="Ask user for explicit approval, then call again with confirm=false (or omit confirm).",
-                raw_stdout="",
-                raw_stderr="",
+                message=f"{spec.image_arg} must point to an existing file",
+                hint=_IMAGE_PATH_HINT,
+                raw_stdout=b"",
+                raw_stderr=b"",
                 latency_ms=0,
             )
 
-        if not os.path.isfile(image_path):
-            return self._error_payload(
-                code="INVALID_ARGUMENT",
-                message="image_path must point to an existing file",
-                hint="Provide a valid local image file path.",
-                raw_stdout="",
-                raw_stderr="",
-                latency_ms=0,
-            )
+        json_args: Tuple[str, ...] = ()
+        if spec.json_output:
+            raw_limit = arguments.get("limit", 20)
+            try:
+                limit = int(raw_limit)
+            except (TypeError, ValueError):
+                return self._error_payload(
+                    code="INVALID_ARGUMENT",
+                    message="limit must be an integer",
+                    hint="Use integer range 1..100 for limit.",
+                    raw_stdout=b"",
+                    raw_stderr=b"",
+                    latency_ms=0,
+                )
+            json_args = ("--json", "--limit", _limit_str(max(1, min(limit, 100))))
 
         deep_recovery = bool(arguments.get("deep_recovery", self.defaults["deep_recovery"]))
         keep_window = bool(arguments.get("keep_window", False))
         trace_ax = bool(arguments.get("trace_ax", self.defaults["trace_ax"]))
 
-        cmd = [self.runner.kmsg_bin, "send-image", chat, image_path]
-        if deep_recovery:
-            cmd.append("--deep-recovery")
-        if keep_window:
-            cmd.append("--keep-window")
-        if trace_ax:
-            cmd.append("--trace-ax")
+        cmd = [
+            *self._tool_prefixes[name],
+            *values,
+            *json_args,
+            *_option_flags(deep_recovery, keep_window, trace_ax),
+        ]
+        label = f"kmsg {spec.subcommand}"
 
-        timeout_sec = 20.0 if deep_recovery else 12.0
+        timeout_sec = spec.deep_recovery_timeout_sec if deep_recovery else spec.timeout_sec
         run = self.runner.run(cmd, timeout_sec=timeout_sec)
 
         if run.timed_out:
             return self._error_payload(
                 code="PROCESS_TIMEOUT",
-                message="kmsg send-image timed out",
-                hint="Retry after ensuring KakaoTalk is responsive.",
+                message=f"{label} timed out",
+                hint=spec.timeout_hint,
                 raw_stdout=run.stdout,
                 raw_stderr=run.stderr,
                 latency_ms=run.latency_ms,
             )
 
         if run.returncode != 0:
-            combined = f"{run.stdout}\n{run.stderr}"
-            code = self._extract_error_code(combined)
-            return self._error_payload(
-                code=code,
-                message="kmsg send-image failed",
-                hint=self._map_hint(code),
-                raw_stdout=run.stdout,
-                raw_stderr=run.stderr,
-                latency_ms=run.latency_ms,
-            )
+            if spec.image_arg and _IMAGE_NOT_FOUND_RE.search(run.stdout):
+                return self._error_payload(
+                    code="INVALID_ARGUMENT",
+                    message=f"{label} failed",
+                    hint=_IMAGE_PATH_HINT,
+                    raw_stdout=run.stdout,
+                    raw_stderr=run.stderr,
+                    latency_ms=run.latency_ms,
+                )
 
-        response: JSONDict = {
-            "ok": True,
-            "chat": chat,
-            "sent": True,
-            "meta": {
-                "latency_ms": run.latency_ms,
-                "stdout": run.stdout,
-            },
-        }
+            code = self._extract_error_code(run.stdout, run.stderr)
+
+            if code == "CHAT_NOT_FOUND" and spec.retry_deep_recovery and not deep_recovery:
+                retry = self.runner.run(cmd + ["--deep-recovery"], timeout_sec=spec.deep_recovery_timeout_sec)
+                if retry.returncode != 0 or retry.timed_out:
+                    retry_code = self._extract_error_code(retry.stdout, retry.stderr)
+                    return self._error_payload(
+                        code=retry_code,
+                        message=f"{label} failed after deep-recovery retry",
+                        hint=_map_hint(retry_code),
+                        raw_stdout=retry.stdout,
+                        raw_stderr=retry.stderr,
+                        latency_ms=retry.latency_ms,
+                    )
+                run = retry
+            else:
+                return self._error_payload(
+                    code=code,
+                    message=f"{label} failed",
+                    hint=_map_hint(code),
+                    raw_stdout=run.stdout,
+                    raw_stderr=run.stderr,
+                    latency_ms=run.latency_ms,
+                )
+
+        response: JSONDict
+        if spec.json_output:
+            try:
+                payload = _loads(run.stdout)
+            except ValueError:
+                # Covers invalid UTF-8 (UnicodeDecodeError from json, a
+                # JSONDecodeError from orjson): parse the replace-decoded text.
+                try:
+                    payload = _loads(_decode_output(run.stdout))
+                except ValueError:
+                    return self._error_payload(
+                        code="INVALID_JSON_OUTPUT",
+                        message=f"kmsg returned non-JSON output for {spec.subcommand} --json",
+                        hint=f"Run {label} manually and confirm JSON-only stdout.",
+                        raw_stdout=run.stdout,
+                        raw_stderr=run.stderr,
+                        latency_ms=run.latency_ms,
+                    )
+
+            response = {
+                "ok": True,
+                "chat": payload.get("chat", values[0]),
+                "fetched_at": payload.get("fetched_at"),
+                "count": payload.get("count", 0),
+                "messages": payload.get("messages", []),
+                "meta": {
+                    "latency_ms": run.latency_ms,
+                },
+            }
+        else:
+            response = {
+                "ok": True,
+                "chat": values[0],
+                "sent": True,
+                "meta": {
+                    "latency_ms": run.latency_ms,
+                    "stdout": _decode_output(run.stdout),
+                },
+            }
 
         if trace_ax and run.stderr.strip():
-            response["meta"]["stderr_trace"] = run.stderr
+            response["meta"]["stderr_trace"] = _decode_output(_bound_stderr(run.stderr))
 
         return response
 
@@ -646,107 +713,143 @@ class OpenClawKmsgMCPServer:
         if not isinstance(call_args, dict):
             raise MCPError(code=-32602, message="tool arguments must be an object")
 
-        if name == "kmsg_read":
-            result_obj = self._call_kmsg_read(call_args)
-        elif name == "kmsg_send":
-            result_obj = self._call_kmsg_send(call_args)
-        elif name == "kmsg_send_image":
-            result_obj = self._call_kmsg_send_image(call_args)
-        else:
+        spec = TOOL_SPECS.get(name) if isinstance(name, str) else None
+        if spec is None:
             raise MCPError(code=-32601, message=f"Unknown tool: {name}")
+        result_obj = self._call_tool(name, spec, call_args)
+
+        is_error = not result_obj.get("ok", False)
+        if self.structured_only and not is_error:
+            text = f"{name} succeeded; see structuredContent for the result."
+        else:
+            text = _dumps(result_obj).decode("utf-8")
 
         return {
-            "content": _make_text_content(json.dumps(result_obj, ensure_ascii=False, indent=2, sort_keys=True)),
-            "isError": not result_obj.get("ok", False),
+            "content": _make_text_content(text),
+            "isError": is_error,
             "structuredContent": result_obj,
         }
 
-    def _handle_request(self, request: JSONDict) -> Optional[JSONDict]:
-        method = request.get("method")
-        req_id = request.get("id")
+    def _handle_initialize(self, params: JSONDict) -> JSONDict:
+        self.initialized = True
+        ready, detail = self.runner.check_ready()
+        if not ready:
+            detail["note"] = "MCP server started, but kmsg readiness check failed"
 
-        if method == "initialize":
-            self.initialized = True
-            ready, detail = self.runner.check_ready()
-            if not ready:
-                detail["note"] = "MCP server started, but kmsg readiness check failed"
+        return {
+            "protocolVersion": self.PROTOCOL_VERSION,
+            "capabilities": {
+                "tools": {},
+            },
+            "serverInfo": {
+                "name": "openclaw-kmsg-mcp",
+                "version": self.server_version,
+            },
+            "instructions": (
+                "Use kmsg_read for read-only operations. "
+                "Use kmsg_send and kmsg_send_image with confirm=false (or omitted) for sending. "
+                "Use confirm=true to intentionally require a confirmation step."
+            ),
+            "meta": {
+                "startup_check": detail,
+            },
+        }
 
-            return _json_rpc_result(
-                req_id,
-                {
-                    "protocolVersion": self.PROTOCOL_VERSION,
-                    "capabilities": {
-                        "tools": {},
-                    },
-                    "serverInfo": {
-                        "name": "openclaw-kmsg-mcp",
-                        "version": self.server_version,
-                    },
-                    "instructions": (
-                        "Use kmsg_read for read-only operations. "
-                        "Use kmsg_send and kmsg_send_image with confirm=false (or omitted) for sending. "
-                        "Use confirm=true to intentionally require a confirmation step."
-                    ),
-                    "meta": {
-                        "startup_check": detail,
-                    },
-                },
-            )
+    def _handle_initialized(self, params: JSONDict) -> None:
+        return None
 
-        if method == "notifications/initialized":
-            return None
+    def _handle_ping(self, params: JSONDict) -> JSONDict:
+        return {}
 
-        if method == "ping":
-            return _json_rpc_result(req_id, {})
+    def _handle_tools_list(self, params: JSONDict) -> JSONDict:
+        return {"tools": self._tools}
 
-        if not self.initialized:
-            raise MCPError(code=-32002, message="Server not initialized")
+    def _handle_shutdown(self, params: JSONDict) -> JSONDict:
+        self.shutdown = True
+        return {}
 
-        if method == "tools/list":
-            return _json_rpc_result(req_id, {"tools": self._tool_definitions()})
+    def _handle_exit(self, params: JSONDict) -> None:
+        self.shutdown = True
+        return None
 
-        if method == "tools/call":
-            result = self._handle_tools_call(request.get("params", {}))
-            return _json_rpc_result(req_id, result)
+    def _handle_request(self, request: JSONDict) -> Optional[JSONDict]:
+        method = request.get("method")
+        handler = self._method_handlers.get(method) if isinstance(method, str) else None
+        if not self.initialized and (handler is None or method not in self.PRE_INIT_METHODS):
+            raise MCPError(code=-32002, message="Server not initialized")
 
-        if method == "shutdown":
-            self.shutdown = True
-            return _json_rpc_result(req_id, {})
+        if handler is None:
+            raise MCPError(code=-32601, message=f"Method not found: {method}")
 
-        if method == "exit":
-            self.shutdown = True
+        result = handler(request.get("params", {}))
+        if result is None:
             return None
+        return _json_rpc_result(request.get("id"), result)
 
-        raise MCPError(code=-32601, message=f"Method not found: {method}")
-
-    def serve_forever(self) -> None:
-        while not self.shutdown:
-            request = self._read_message()
-            if request is None:
-                break
+    def _process_request(self, request: JSONDict) -> None:
+        req_id = request.get("id")
+        try:
+            response = self._handle_request(request)
+        except MCPError as err:
+            if req_id is None:
+                return
+            response = _json_rpc_error(req_id, err.code, err.message, err.data)
+        except Exception as err:  # noqa: BLE001
+            if req_id is None:
+                return
+            response = _json_rpc_error(
+                req_id,
+                -32000,
+                "Internal server error",
+                {"detail": str(err)},
+            )
 
-            if "method" not in request:
-                continue
+        if response is None:
+            return
 
-            req_id = request.get("id")
+        try:
+            self._write_message(response)
+        except Exception as err:  # noqa: BLE001
+            # Tool calls run on a worker whose future nobody inspects, so an
+            # unencodable response must not vanish and leave the client
+            # waiting: log it and try a plain error for the same id.
+            print(f"kmsg-mcp: failed to write response for id {req_id!r}: {err}", file=sys.stderr)
+            if req_id is None:
+                return
             try:
-                response = self._handle_request(request)
-            except MCPError as err:
-                if req_id is None:
-                    continue
-                response = _json_rpc_error(req_id, err.code, err.message, err.data)
-            except Exception as err:  # noqa: BLE001
-                if req_id is None:
-                    continue
-                response = _json_rpc_error(
-                    req_id,
-                    -32000,
-                    "Internal server error",
-                    {"detail": str(err)},
+                self._write_message(
+                    _json_rpc_error(req_id, -32000, "Internal server error", {"detail": str(err)})
                 )
+            except Exception as fallback_err:  # noqa: BLE001
+                print(f"kmsg-mcp: failed to write error for id {req_id!r}: {fallback_err}", file=sys.stderr)
 
-            if response is not None:
-                self._write_message(response)
+    def serve_forever(self) -> None:
+        # Tool calls drive the KakaoTalk UI and must not overlap, so they run
+        # one at a time on a single worker thread. Every other method is
+        # answered on the reader thread, which keeps ping and tools/list
+        # responsive while a slow kmsg call is in flight.
+        writer = threading.Thread(target=self._drain_output, name="kmsg-mcp-writer", daemon=True)
+        writer.start()
+        tool_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="kmsg-tool")
+        try:
+            while not self.shutdown:
+                request = self._read_message()
+                if request is None:
+                    break
+
+                if not isinstance(request, dict) or "method" not in request:
+                    continue
+
+                # Only queue tool calls once initialized, judged in read order;
+                # an early tools/call is rejected inline by _handle_request.
+                if request["method"] == "tools/call" and self.initialized:
+                    tool_worker.submit(self._process_request, request)
+                else:
+                    self._process_request(request)
+        finally:
+            tool_worker.shutdown(wait=True)
+            self._out_queue.put(None)
+            writer.join()
 
 
 def main() -> int: